@@ -3,37 +3,120 @@
 file_monitor.py - Monitors directories for file changes
 """
 import os
+import sys
 import time
 import json
 import logging
+import threading
+from queue import Queue
 from watchdog.observers import Observer
+from watchdog.observers.polling import PollingObserver
 from watchdog.events import FileSystemEventHandler
 
+from core.sync_engine import coalesce_event
+
+# Filesystems where native change notifications miss remote-side writes
+NETWORK_FS_TYPES = ('nfs', 'cifs', 'smb')
+
+def _fs_type(path):
+    """Classify the filesystem holding path as 'nfs', 'cifs', 'smb' or 'local'"""
+    path = os.path.realpath(path)
+    
+    if sys.platform.startswith('win'):
+        if path.startswith('\\\\'):
+            return 'smb'
+        import ctypes
+        drive = os.path.splitdrive(path)[0] + '\\'
+        DRIVE_REMOTE = 4
+        if ctypes.windll.kernel32.GetDriveTypeW(drive) == DRIVE_REMOTE:
+            return 'smb'
+        return 'local'
+    
+    try:
+        with open('/proc/self/mountinfo', 'r') as f:
+            mounts = f.readlines()
+    except OSError:
+        return 'local'
+    
+    # The deepest mount point containing the path determines its filesystem
+    best_mount, best_type = '', 'local'
+    for line in mounts:
+        fields, _, fs_fields = line.partition(' - ')
+        fields = fields.split()
+        if len(fields) < 5 or not fs_fields:
+            continue
+        mount_point = fields[4].replace('\\040', ' ')
+        fs_name = fs_fields.split()[0]
+        if path != mount_point and not path.startswith(mount_point.rstrip('/') + '/'):
+            continue
+        if len(mount_point) >= len(best_mount):
+            best_mount, best_type = mount_point, fs_name
+    
+    if best_type.startswith('nfs'):
+        return 'nfs'
+    if best_type == 'cifs':
+        return 'cifs'
+    if best_type.startswith('smb'):
+        return 'smb'
+    return 'local'
+
+# Window in which raw watchdog events for the same path are coalesced
+DEBOUNCE_SECONDS = 0.15
+
 class FileChangeHandler(FileSystemEventHandler):
-    """Handles file system events and logs changes"""
+    """Handles file system events and queues debounced batches of changes"""
     
     def __init__(self, sync_queue, config):
         self.sync_queue = sync_queue
         self.config = config
         self.logger = logging.getLogger('modsync.file_monitor')
+        self._pending = {}  # path -> (action, dest_path)
+        self._lock = threading.Lock()
+        self._timer = None
+    
+    def _record(self, action, path, dest_path=None):
+        """Buffer an event and arm the flush timer if it is not already running"""
+        with self._lock:
+            coalesce_event(self._pending, action, path, dest_path)
+            
+            # The window starts at the first buffered event and is not pushed back by
+            # later ones, so a steady stream of events still gets flushed regularly
+            if self._timer is None:
+                self._timer = threading.Timer(DEBOUNCE_SECONDS, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+    
+    def flush(self):
+        """Drain buffered events into the sync queue as a single batch"""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            pending, self._pending = self._pending, {}
+        
+        if pending:
+            batch = [(action, path, dest_path)
+                     for path, (action, dest_path) in pending.items()]
+            self.sync_queue.put(batch)
+            self.logger.debug(f"Queued batch of {len(batch)} change(s)")
     
     def on_modified(self, event):
         if event.is_directory:
             return
         self.logger.info(f"File modified: {event.src_path}")
-        self.sync_queue.put(('modified', event.src_path))
+        self._record('modified', event.src_path)
     
     def on_created(self, event):
         self.logger.info(f"File created: {event.src_path}")
-        self.sync_queue.put(('created', event.src_path))
+        self._record('created', event.src_path)
     
     def on_deleted(self, event):
         self.logger.info(f"File deleted: {event.src_path}")
-        self.sync_queue.put(('deleted', event.src_path))
+        self._record('deleted', event.src_path)
     
     def on_moved(self, event):
         self.logger.info(f"File moved from {event.src_path} to {event.dest_path}")
-        self.sync_queue.put(('moved', (event.src_path, event.dest_path)))
+        self._record('moved', event.src_path, event.dest_path)
 
 
 class FileMonitor:
@@ -43,7 +126,8 @@ class FileMonitor:
         self.logger = logging.getLogger('modsync.file_monitor')
         self.config = self._load_config(config_path)
         self.observers = []
-        self.sync_queue = []  # This would be replaced with a proper queue in a multi-threaded app
+        self.handlers = []
+        self.sync_queue = Queue()  # Receives lists of (action, path, dest_path) events
     
     def _load_config(self, config_path):
         """Load configuration from JSON file"""
@@ -54,6 +138,18 @@ class FileMonitor:
             self.logger.error(f"Error loading config: {e}")
             return {}
     
+    def _fast_watcher(self, local_path):
+        """Create an inotify_simple based watcher, or None if it is unavailable"""
+        try:
+            from core.platforms.linux.fast_watcher import LinuxFastWatcher
+            watcher = LinuxFastWatcher(local_path, self.sync_queue)
+        except (ImportError, OSError) as e:
+            # OSError covers running out of inotify instances (EMFILE)
+            self.logger.debug(f"Fast inotify watcher unavailable: {e}")
+            return None
+        self.logger.info(f"Using fast inotify watcher for {local_path}")
+        return watcher
+    
     def start_monitoring(self):
         """Start monitoring all configured directories"""
         for dir_config in self.config.get('sync_directories', []):
@@ -62,11 +158,27 @@ class FileMonitor:
                 self.logger.warning(f"Directory does not exist: {local_path}")
                 continue
             
+            fs_type = _fs_type(local_path)
+            if fs_type == 'local' and sys.platform.startswith('linux'):
+                watcher = self._fast_watcher(local_path)
+                if watcher:
+                    watcher.start()
+                    self.observers.append(watcher)
+                    self.logger.info(f"Started monitoring: {local_path}")
+                    continue
+            
             event_handler = FileChangeHandler(self.sync_queue, self.config)
-            observer = Observer()
+            if fs_type in NETWORK_FS_TYPES:
+                poll_interval = dir_config.get('poll_interval', 2.0)
+                observer = PollingObserver(timeout=poll_interval)
+                self.logger.info(f"Using polling observer ({fs_type}, every {poll_interval}s) for {local_path}")
+            else:
+                observer = Observer()
+                self.logger.info(f"Using native observer for {local_path}")
             observer.schedule(event_handler, local_path, recursive=True)
             observer.start()
             self.observers.append(observer)
+            self.handlers.append(event_handler)
             self.logger.info(f"Started monitoring: {local_path}")
     
     def stop_monitoring(self):
@@ -77,6 +189,10 @@ class FileMonitor:
         for observer in self.observers:
             observer.join()
         
+        # Hand off anything still waiting in a debounce window
+        for handler in self.handlers:
+            handler.flush()
+        
         self.logger.info("Stopped all directory monitoring")
 
 if __name__ == "__main__":
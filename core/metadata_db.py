@@ -4,46 +4,215 @@ metadata_db.py - Tracks file metadata for synchronization
 """
 import os
 import json
+import time
+import atexit
+import hashlib
 import logging
 import sqlite3
+import pathlib
+import threading
+from contextlib import contextmanager
 from datetime import datetime
 
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+# Read buffer reused for every chunk while hashing
+HASH_CHUNK_SIZE = 1 << 20
+
+# Connection tuning applied to every connection
+PRAGMAS = (
+    'PRAGMA busy_timeout=5000',
+    'PRAGMA cache_size=-20000',
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA mmap_size=268435456',
+)
+
+# Insert a synced file or refresh its existing row in one statement
+UPSERT_SQL = '''
+INSERT INTO files (path, modified_time, size, last_synced, sync_status, checksum, modified_time_ns)
+VALUES (?, ?, ?, ?, 'synced', ?, ?)
+ON CONFLICT(path) DO UPDATE SET
+    modified_time = excluded.modified_time,
+    modified_time_ns = excluded.modified_time_ns,
+    size = excluded.size,
+    last_synced = excluded.last_synced,
+    sync_status = 'synced',
+    checksum = excluded.checksum
+'''
+
+# Seconds between background maintenance passes
+MAINTENANCE_INTERVAL = 15 * 60
+
+# Reclaim free pages, shrink the WAL and refresh query planner statistics
+MAINTENANCE_PRAGMAS = (
+    'PRAGMA incremental_vacuum(128000)',
+    'PRAGMA wal_checkpoint(TRUNCATE)',
+    'PRAGMA optimize',
+)
+
+# Tuning that only makes sense on the writer
+WRITE_PRAGMAS = (
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA journal_size_limit=67108864',
+)
+
+def new_hasher():
+    """Return (name, hasher) for the fastest available content hash"""
+    if xxhash is not None:
+        return 'xxh3_64', xxhash.xxh3_64()
+    return 'blake2b', hashlib.blake2b(digest_size=16)
+
+def file_checksum(file_path):
+    """Hash a file's contents, returning '<algorithm>:<hexdigest>'"""
+    name, hasher = new_hasher()
+    # Plain reads rather than mmap: a file truncated mid-hash just ends early
+    # instead of killing the process with SIGBUS
+    buf = bytearray(HASH_CHUNK_SIZE)
+    view = memoryview(buf)
+    with open(file_path, 'rb', buffering=0) as f:
+        while True:
+            n = f.readinto(buf)
+            if not n:
+                break
+            hasher.update(view[:n])
+    return f"{name}:{hasher.hexdigest()}"
+
+def descendant_range(path):
+    """Bounds (exclusive) of the paths below a directory, for an indexed range scan"""
+    return path + os.sep, path + chr(ord(os.sep) + 1)
+
 class MetadataDB:
     """Manages file metadata for tracking sync state"""
     
     def __init__(self, db_path):
         self.logger = logging.getLogger('modsync.metadata_db')
         self.db_path = db_path
+        
+        is_new = not os.path.exists(db_path) or os.path.getsize(db_path) == 0
+        
+        # One shared writer serialized by a lock, plus a read-only connection per thread
+        self._write_conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        if is_new:
+            # Only takes effect before any table exists
+            self._write_conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+        for pragma in PRAGMAS + WRITE_PRAGMAS:
+            self._write_conn.execute(pragma)
+        self._write_lock = threading.Lock()
+        self._reads = threading.local()
+        self._read_conns = []
+        self._closed = False
+        self._maintenance_timer = None
+        
         self._init_db()
+        self._schedule_maintenance()
+        atexit.register(self.close)
+    
+    def _read_conn(self):
+        """Return this thread's read-only connection, opening it on first use"""
+        conn = getattr(self._reads, 'conn', None)
+        if conn is None:
+            uri = pathlib.Path(self.db_path).resolve().as_uri() + '?mode=ro'
+            conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+            for pragma in PRAGMAS:
+                conn.execute(pragma)
+            self._reads.conn = conn
+            with self._write_lock:
+                self._read_conns.append(conn)
+        return conn
+    
+    @contextmanager
+    def _write(self):
+        """Run the enclosed statements in one immediate transaction on the writer"""
+        with self._write_lock:
+            cursor = self._write_conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            try:
+                yield cursor
+            except Exception:
+                cursor.execute('ROLLBACK')
+                raise
+            cursor.execute('COMMIT')
+    
+    def _schedule_maintenance(self):
+        """Arm the timer for the next maintenance pass"""
+        self._maintenance_timer = threading.Timer(MAINTENANCE_INTERVAL, self._run_maintenance)
+        self._maintenance_timer.daemon = True
+        self._maintenance_timer.start()
+    
+    def _run_maintenance(self):
+        self.maintenance()
+        if not self._closed:
+            self._schedule_maintenance()
+    
+    def maintenance(self):
+        """Reclaim free pages, truncate the WAL and let SQLite refresh its statistics"""
+        try:
+            with self._write_lock:
+                if self._closed:
+                    return
+                # executescript steps each pragma to completion; a plain execute would
+                # make incremental_vacuum free only a single page
+                self._write_conn.executescript(';'.join(MAINTENANCE_PRAGMAS))
+            self.logger.debug("Completed database maintenance")
+        
+        except Exception as e:
+            self.logger.error(f"Error during database maintenance: {e}")
+    
+    def close(self):
+        """Close all database connections"""
+        if self._maintenance_timer:
+            self._maintenance_timer.cancel()
+        with self._write_lock:
+            if self._closed:
+                return
+            self._closed = True
+            for conn in self._read_conns:
+                conn.close()
+            self._read_conns = []
+            try:
+                self._write_conn.execute('PRAGMA optimize')
+            except sqlite3.Error as e:
+                self.logger.warning(f"Error optimizing database on close: {e}")
+            self._write_conn.close()
+        self._reads = threading.local()
     
     def _init_db(self):
         """Initialize the SQLite database"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            # Create files table if it doesn't exist
-            cursor.execute('''
-            CREATE TABLE IF NOT EXISTS files (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                path TEXT UNIQUE,
-                modified_time REAL,
-                size INTEGER,
-                last_synced REAL,
-                sync_status TEXT,
-                checksum TEXT
-            )
-            ''')
+            with self._write() as cursor:
+                # Create files table if it doesn't exist
+                cursor.execute('''
+                CREATE TABLE IF NOT EXISTS files (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    path TEXT UNIQUE,
+                    modified_time REAL,
+                    size INTEGER,
+                    last_synced REAL,
+                    sync_status TEXT,
+                    checksum TEXT,
+                    modified_time_ns INTEGER
+                )
+                ''')
+                
+                # Databases created before modified_time_ns existed gain the column here;
+                # their rows are re-synced once since the stored value starts as NULL
+                columns = [row[1] for row in cursor.execute("PRAGMA table_info(files)")]
+                if 'modified_time_ns' not in columns:
+                    cursor.execute("ALTER TABLE files ADD COLUMN modified_time_ns INTEGER")
+                
+                cursor.execute("CREATE INDEX IF NOT EXISTS idx_files_path ON files(path)")
             
-            conn.commit()
-            conn.close()
             self.logger.info(f"Initialized metadata database at {self.db_path}")
         
         except Exception as e:
             self.logger.error(f"Error initializing database: {e}")
     
-    def update_file_metadata(self, file_path):
-        """Update metadata for a file"""
+    def update_file_metadata(self, file_path, checksum=None):
+        """Update metadata for a file, hashing it unless checksum is given"""
         try:
             if not os.path.exists(file_path):
                 self.delete_file_metadata(file_path)
@@ -52,59 +221,93 @@ class MetadataDB:
             stat = os.stat(file_path)
             modified_time = stat.st_mtime
             size = stat.st_size
+            if checksum is None:
+                checksum = file_checksum(file_path)
             
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            # Check if file exists in DB
-            cursor.execute("SELECT * FROM files WHERE path = ?", (file_path,))
-            existing = cursor.fetchone()
-            
-            if existing:
-                cursor.execute('''
-                UPDATE files 
-                SET modified_time = ?, size = ?, last_synced = ?, sync_status = ?
-                WHERE path = ?
-                ''', (modified_time, size, time.time(), 'synced', file_path))
-            else:
-                cursor.execute('''
-                INSERT INTO files (path, modified_time, size, last_synced, sync_status)
-                VALUES (?, ?, ?, ?, ?)
-                ''', (file_path, modified_time, size, time.time(), 'synced'))
+            with self._write() as cursor:
+                cursor.execute(UPSERT_SQL, (file_path, modified_time, size, time.time(), checksum,
+                                            stat.st_mtime_ns))
             
-            conn.commit()
-            conn.close()
             self.logger.debug(f"Updated metadata for {file_path}")
         
         except Exception as e:
             self.logger.error(f"Error updating metadata for {file_path}: {e}")
     
-    def delete_file_metadata(self, file_path):
-        """Delete metadata for a file"""
+    def update_many(self, file_paths, stats=None, checksums=None):
+        """Update metadata for many files in a single transaction
+        
+        stats may map paths to already-known os.stat results and checksums
+        to content hashes; files without a known checksum are stored without one.
+        """
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+            now = time.time()
+            stats = stats or {}
+            checksums = checksums or {}
+            rows = []
+            for file_path in file_paths:
+                stat = stats.get(file_path)
+                if stat is None:
+                    try:
+                        stat = os.stat(file_path)
+                    except FileNotFoundError:
+                        self.logger.debug(f"Skipping metadata for vanished file: {file_path}")
+                        continue
+                rows.append((file_path, stat.st_mtime, stat.st_size, now, checksums.get(file_path),
+                             stat.st_mtime_ns))
             
-            cursor.execute("DELETE FROM files WHERE path = ?", (file_path,))
+            if rows:
+                with self._write() as cursor:
+                    cursor.executemany(UPSERT_SQL, rows)
+            
+            self.logger.debug(f"Updated metadata for {len(rows)} files")
+        
+        except Exception as e:
+            self.logger.error(f"Error updating metadata in bulk: {e}")
+    
+    def delete_file_metadata(self, file_path):
+        """Delete metadata for a file, or for everything below a directory"""
+        try:
+            with self._write() as cursor:
+                cursor.execute("DELETE FROM files WHERE path = ? OR (path > ? AND path < ?)",
+                               (file_path, *descendant_range(file_path)))
             
-            conn.commit()
-            conn.close()
             self.logger.debug(f"Deleted metadata for {file_path}")
         
         except Exception as e:
             self.logger.error(f"Error deleting metadata for {file_path}: {e}")
     
+    def move_file_metadata(self, src_path, dest_path):
+        """Re-path metadata for a moved file or directory, returning the rows moved
+        
+        A rename keeps contents and mtime, so the existing rows stay valid
+        under their new paths without rehashing anything.
+        """
+        try:
+            with self._write() as cursor:
+                # Whatever the move replaced at the destination is gone
+                cursor.execute("DELETE FROM files WHERE path = ? OR (path > ? AND path < ?)",
+                               (dest_path, *descendant_range(dest_path)))
+                cursor.execute(
+                    "UPDATE files SET path = ? || substr(path, ?) "
+                    "WHERE path = ? OR (path > ? AND path < ?)",
+                    (dest_path, len(src_path) + 1, src_path, *descendant_range(src_path))
+                )
+                moved = cursor.rowcount
+            
+            self.logger.debug(f"Moved metadata for {src_path} -> {dest_path}")
+            return moved
+        
+        except Exception as e:
+            self.logger.error(f"Error moving metadata for {src_path}: {e}")
+            return 0
+    
     def get_file_metadata(self, file_path):
         """Get metadata for a file"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
+            cursor = self._read_conn().cursor()
             cursor.execute("SELECT * FROM files WHERE path = ?", (file_path,))
             row = cursor.fetchone()
             
-            conn.close()
-            
             if row:
                 return {
                     'id': row[0],
@@ -113,7 +316,8 @@ class MetadataDB:
                     'size': row[3],
                     'last_synced': row[4],
                     'sync_status': row[5],
-                    'checksum': row[6]
+                    'checksum': row[6],
+                    'modified_time_ns': row[7]
                 }
             return None
         
@@ -131,7 +335,36 @@ class MetadataDB:
             return True
         
         stat = os.stat(file_path)
-        return stat.st_mtime > metadata['modified_time'] or stat.st_size != metadata['size']
+        return stat.st_mtime_ns != metadata['modified_time_ns'] or stat.st_size != metadata['size']
+    
+    def needs_sync_many(self, file_paths, stats=None):
+        """Return the subset of file_paths that need to be synced
+        
+        Stored and current state are both reduced to (path, mtime_ns, size)
+        tuples, so the changed files are a single set difference. Integer
+        nanosecond mtimes avoid float rounding in the comparison. stats may
+        map paths to already-known os.stat results so they are not stat'ed again.
+        """
+        try:
+            cursor = self._read_conn().cursor()
+            cursor.execute("SELECT path, modified_time_ns, size FROM files")
+            known = frozenset(cursor)
+        except Exception as e:
+            self.logger.error(f"Error loading metadata: {e}")
+            known = frozenset()
+        
+        stats = stats or {}
+        current = set()
+        for file_path in file_paths:
+            stat = stats.get(file_path)
+            if stat is None:
+                try:
+                    stat = os.stat(file_path)
+                except FileNotFoundError:
+                    continue
+            current.add((file_path, stat.st_mtime_ns, stat.st_size))
+        
+        return {file_path for file_path, _, _ in current - known}
 
 if __name__ == "__main__":
     # Setup basic logging
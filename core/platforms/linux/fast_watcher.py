@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+fast_watcher.py - Low-overhead inotify watcher for local directories on Linux
+"""
+import os
+import logging
+import threading
+from inotify_simple import INotify, flags
+
+from core.sync_engine import coalesce_event
+
+WATCH_MASK = flags.MODIFY | flags.CREATE | flags.DELETE | flags.MOVED_FROM | flags.MOVED_TO
+
+class LinuxFastWatcher:
+    """Watches a directory tree with inotify and queues batches of changes
+    
+    Reads raw inotify events through inotify_simple, letting the kernel
+    accumulate them for read_delay milliseconds, and puts one deduplicated
+    list of (action, path, dest_path) events per read on the sync queue.
+    Provides start/stop/join so FileMonitor can manage it like a watchdog
+    observer.
+    """
+    
+    def __init__(self, local_path, sync_queue, read_timeout=100, read_delay=100):
+        self.logger = logging.getLogger('modsync.linux.fast_watcher')
+        self.local_path = local_path
+        self.sync_queue = sync_queue
+        self.read_timeout = read_timeout
+        self.read_delay = read_delay
+        self._inotify = INotify()
+        self._watches = {}  # watch descriptor -> directory path
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+    
+    def _add_watches(self, root):
+        """Watch root and every directory below it, returning the files found"""
+        files = []
+        stack = [root]
+        while stack:
+            path = stack.pop()
+            try:
+                # Re-adding a watched inode returns its existing descriptor, so this
+                # also refreshes paths after a directory is moved
+                wd = self._inotify.add_watch(path, WATCH_MASK)
+            except OSError as e:
+                self.logger.warning(f"Could not watch {path}: {e}")
+                continue
+            self._watches[wd] = path
+            
+            try:
+                with os.scandir(path) as it:
+                    for entry in it:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        else:
+                            files.append(entry.path)
+            except OSError as e:
+                self.logger.warning(f"Could not scan directory {path}: {e}")
+        return files
+    
+    def _remove_watches(self, root):
+        """Stop watching root and every directory below it"""
+        prefix = root + os.sep
+        for wd, path in list(self._watches.items()):
+            if path == root or path.startswith(prefix):
+                del self._watches[wd]
+                try:
+                    self._inotify.rm_watch(wd)
+                except OSError:
+                    # Already gone, e.g. the directory was deleted after the move
+                    pass
+    
+    def _queue_batch(self, events):
+        """Collapse one read's worth of events and put them on the sync queue"""
+        pending = {}  # path -> (action, dest_path)
+        moved_from = {}  # cookie -> (source path, is directory)
+        
+        def record(action, path, dest_path=None):
+            coalesce_event(pending, action, path, dest_path)
+        
+        for event in events:
+            if event.mask & flags.IGNORED:
+                self._watches.pop(event.wd, None)
+                continue
+            if event.mask & flags.Q_OVERFLOW:
+                # Events were dropped (e.g. a large checkout), so rescan the whole tree.
+                # Queued as 'modified' so files whose checksum still matches the last
+                # sync are not copied again; deletions still need a full sync
+                self.logger.warning(f"inotify queue overflowed for {self.local_path}; rescanning")
+                for file_path in self._add_watches(self.local_path):
+                    record('modified', file_path)
+                continue
+            
+            directory = self._watches.get(event.wd)
+            if directory is None or not event.name:
+                continue
+            path = os.path.join(directory, event.name)
+            is_dir = event.mask & flags.ISDIR
+            
+            if event.mask & flags.MOVED_FROM:
+                moved_from[event.cookie] = (path, is_dir)
+            elif event.mask & flags.MOVED_TO:
+                src_path, _ = moved_from.pop(event.cookie, (None, None))
+                if is_dir:
+                    found = self._add_watches(path)
+                    if src_path is None:
+                        for file_path in found:
+                            record('created', file_path)
+                        continue
+                if src_path:
+                    record('moved', src_path, path)
+                else:
+                    record('created', path)
+            elif event.mask & flags.CREATE:
+                if is_dir:
+                    # Files may already exist if the directory was filled before we watched it
+                    for file_path in self._add_watches(path):
+                        record('created', file_path)
+                else:
+                    record('created', path)
+            elif event.mask & flags.DELETE:
+                # Directory contents report their own deletions first, so removing
+                # the directory afterwards only clears what is left remotely
+                record('deleted', path)
+            elif event.mask & flags.MODIFY:
+                record('modified', path)
+        
+        # Moved out of the watched tree
+        for src_path, is_dir in moved_from.values():
+            if is_dir:
+                self._remove_watches(src_path)
+            record('deleted', src_path)
+        
+        if pending:
+            batch = [(action, path, dest_path) for path, (action, dest_path) in pending.items()]
+            self.sync_queue.put(batch)
+            self.logger.debug(f"Queued batch of {len(batch)} change(s) from {len(events)} events")
+    
+    def _run(self):
+        while not self._stop_event.is_set():
+            try:
+                events = self._inotify.read(timeout=self.read_timeout, read_delay=self.read_delay)
+                if events:
+                    self._queue_batch(events)
+            except Exception as e:
+                self.logger.error(f"Error reading inotify events: {e}")
+    
+    def start(self):
+        """Start watching in a background thread"""
+        self._add_watches(self.local_path)
+        self._thread.start()
+    
+    def stop(self):
+        """Ask the watcher thread to stop"""
+        self._stop_event.set()
+    
+    def join(self):
+        """Wait for the watcher thread to finish and release the inotify handle"""
+        if self._thread.is_alive():
+            self._thread.join()
+        self._inotify.close()
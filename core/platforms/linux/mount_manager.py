@@ -3,9 +3,16 @@
 mount_manager.py - Manages NFS mounts on Linux
 """
 import os
+import time
+import ctypes
+import ctypes.util
+import socket
 import subprocess
 import logging
 
+# How long an is_mounted() answer is reused before checking again
+MOUNT_CACHE_TTL = 1.0
+
 class LinuxMountManager:
     """Manages NFS mounts on Linux systems"""
     
@@ -15,15 +22,64 @@ class LinuxMountManager:
         self.server = config['server']['nfs_server']
         self.share = config['server']['nfs_share']
         self.mount_point = config['server']['mount_point']
+        self.nfs_options = config['server'].get('nfs_options', 'vers=4.2')
+        self._mounted_cache = None  # (timestamp, mounted)
+    
+    def _read_mount_status(self):
+        """Look for the share in /proc/self/mountinfo without spawning mount(8)"""
+        source = f"{self.server}:{self.share}"
+        mount_point = os.path.normpath(self.mount_point)
+        
+        with open('/proc/self/mountinfo', 'r') as f:
+            for line in f:
+                fields, _, fs_fields = line.partition(' - ')
+                fields = fields.split()
+                fs_fields = fs_fields.split()
+                if len(fields) < 5 or len(fs_fields) < 2:
+                    continue
+                target = fields[4].replace('\\040', ' ')
+                fs_type, fs_source = fs_fields[0], fs_fields[1]
+                if fs_source == source or (target == mount_point and fs_type.startswith('nfs')):
+                    return True
+        return False
     
     def is_mounted(self):
         """Check if the NFS share is already mounted"""
+        now = time.monotonic()
+        if self._mounted_cache and now - self._mounted_cache[0] < MOUNT_CACHE_TTL:
+            return self._mounted_cache[1]
+        
+        try:
+            mounted = self._read_mount_status()
+        except OSError:
+            # No procfs available; fall back to asking mount(8)
+            try:
+                result = subprocess.run(['mount'], capture_output=True, text=True)
+                mounted = f"{self.server}:{self.share}" in result.stdout
+            except Exception as e:
+                self.logger.error(f"Error checking mount status: {e}")
+                return False
+        
+        self._mounted_cache = (now, mounted)
+        return mounted
+    
+    def _mount_syscall(self):
+        """Mount the share with mount(2) directly, skipping sudo and mount.nfs"""
         try:
-            result = subprocess.run(['mount'], capture_output=True, text=True)
-            return f"{self.server}:{self.share}" in result.stdout
+            libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+            # The kernel NFS client needs the server address resolved up front,
+            # which mount.nfs would otherwise do for us
+            options = f"{self.nfs_options},addr={socket.gethostbyname(self.server)}"
+            source = f"{self.server}:{self.share}"
+            
+            if libc.mount(source.encode(), self.mount_point.encode(), b'nfs', 0, options.encode()) == 0:
+                return True
+            
+            err = ctypes.get_errno()
+            self.logger.warning(f"mount(2) failed ({os.strerror(err)}), falling back to mount(8)")
         except Exception as e:
-            self.logger.error(f"Error checking mount status: {e}")
-            return False
+            self.logger.warning(f"mount(2) unavailable ({e}), falling back to mount(8)")
+        return False
     
     def mount(self):
         """Mount the NFS share"""
@@ -35,11 +91,18 @@ class LinuxMountManager:
             # Ensure mount point exists
             os.makedirs(self.mount_point, exist_ok=True)
             
+            # Running as root we can mount without spawning any processes
+            if os.geteuid() == 0 and self._mount_syscall():
+                self._mounted_cache = None
+                self.logger.info(f"Successfully mounted {self.server}:{self.share} to {self.mount_point}")
+                return True
+            
             # Mount the NFS share
             cmd = ['sudo', 'mount', '-t', 'nfs', f"{self.server}:{self.share}", self.mount_point]
             result = subprocess.run(cmd, capture_output=True, text=True)
             
             if result.returncode == 0:
+                self._mounted_cache = None
                 self.logger.info(f"Successfully mounted {self.server}:{self.share} to {self.mount_point}")
                 return True
             else:
@@ -61,6 +124,7 @@ class LinuxMountManager:
             result = subprocess.run(cmd, capture_output=True, text=True)
             
             if result.returncode == 0:
+                self._mounted_cache = None
                 self.logger.info(f"Successfully unmounted {self.mount_point}")
                 return True
             else:
@@ -3,19 +3,116 @@
 sync_engine.py - Core synchronization logic
 """
 import os
+import re
+import errno
 import shutil
 import json
+import fnmatch
+import functools
 import logging
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 
+from core.metadata_db import MetadataDB, file_checksum, new_hasher
+
+# Errors meaning a kernel copy primitive cannot handle this pair of files
+COPY_FALLBACK_ERRNOS = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP}
+
+# Largest request handed to a single kernel copy call
+KERNEL_COPY_CHUNK = 1 << 30
+
+# Buffer used when copying and hashing in the same pass
+HASH_COPY_BUFFER = 1 << 20
+
+def merge_actions(previous, action):
+    """Combine a pending action with a newer one for the same path"""
+    # A file created and then written within the window is still new remotely,
+    # and one that already exists remotely stays a modify when it is recreated;
+    # otherwise the newest action wins (modified+deleted -> deleted)
+    if previous == 'created' and action == 'modified':
+        return 'created'
+    if previous == 'modified' and action == 'created':
+        return 'modified'
+    return action
+
+def _detach_move(pending, path):
+    """Replace a pending move away from path with a copy of its destination
+    
+    Called before another event reuses path, since one dict entry cannot
+    hold both. Returns the pending entry for path; a replaced move leaves
+    the old file in place remotely, so it is reported as 'modified'.
+    """
+    previous = pending.get(path)
+    if not previous or previous[0] != 'moved':
+        return previous
+    
+    del pending[path]
+    dest_path = previous[1]
+    # Later events for the destination still apply; copying it supersedes a modify
+    if pending.get(dest_path, ('modified',))[0] == 'modified':
+        pending.pop(dest_path, None)
+        pending[dest_path] = ('created', None)
+    return ('modified', None)
+
+def coalesce_event(pending, action, path, dest_path=None):
+    """Fold an event into pending, a dict of path -> (action, dest_path)
+    
+    Entries are re-inserted on every change so iteration order follows the
+    latest event for each path.
+    """
+    previous = _detach_move(pending, path)
+    pending.pop(path, None)
+    
+    if action != 'moved':
+        if previous:
+            action = merge_actions(previous[0], action)
+        pending[path] = (action, dest_path)
+        return
+    
+    # The move replaces whatever was pending for the destination
+    _detach_move(pending, dest_path)
+    pending.pop(dest_path, None)
+    
+    if previous and previous[0] == 'created':
+        # The source never reached the remote side (e.g. an editor's temp file
+        # renamed over the real one), so copy the destination instead
+        pending[dest_path] = ('created', None)
+        return
+    if previous and previous[0] == 'modified':
+        # The remote copy of the source is stale; replace it rather than move it
+        pending[path] = ('deleted', None)
+        pending[dest_path] = ('created', None)
+        return
+    
+    for key, (prev_action, prev_dest) in list(pending.items()):
+        if prev_action == 'moved' and prev_dest == path:
+            # Chained move: remotely the file still has its original name
+            del pending[key]
+            pending[key] = ('moved', dest_path)
+            return
+    
+    pending[path] = ('moved', dest_path)
+
 class SyncEngine:
     """Handles file synchronization between local and remote directories"""
     
     def __init__(self, config_path):
         self.logger = logging.getLogger('modsync.sync_engine')
         self.config = self._load_config(config_path)
-        self.metadata_db = {}  # This would be replaced with a proper database
+        self._trie, self._fallback_exclude_re = self._compile_directories()
+        self._directory_for = functools.lru_cache(maxsize=4096)(self._match_directory)
+        sync_settings = self.config.get('sync_settings', {})
+        self.metadata_db = MetadataDB(sync_settings.get('metadata_db', 'sync_metadata.db'))
+        # Copies to NFS are latency-bound, so several in flight keep the link busy
+        self._pool = ThreadPoolExecutor(
+            max_workers=sync_settings.get('workers', 8),
+            thread_name_prefix='modsync-sync'
+        )
+        # Remote directories known to exist, so each costs one mkdir per run
+        self._known_dirs = set()
+        self._dirs_lock = threading.Lock()
     
     def _load_config(self, config_path):
         """Load configuration from JSON file"""
@@ -26,102 +123,341 @@ class SyncEngine:
             self.logger.error(f"Error loading config: {e}")
             return {}
     
-    def _get_remote_path(self, local_path):
-        """Convert a local path to its corresponding remote path"""
+    def _compile_exclude(self, patterns):
+        """Compile fnmatch-style patterns into one regex, or None if there are none"""
+        if not patterns:
+            return None
+        return re.compile('|'.join(fnmatch.translate(pattern) for pattern in patterns))
+    
+    def _split_path(self, path):
+        """Split a path into its non-empty components"""
+        return [part for part in os.path.normpath(path).split(os.sep) if part]
+    
+    def _compile_directories(self):
+        """Build a path-component trie of (local_root, remote_root, exclude_re) entries
+        
+        Each node is a dict keyed by path component; a configured sync
+        directory stores its entry under the None key of its node.
+        """
+        trie = {}
+        all_patterns = []
+        mount_point = self.config.get('server', {}).get('mount_point', '')
+        
         for dir_config in self.config.get('sync_directories', []):
+            patterns = dir_config.get('exclude_patterns', [])
+            all_patterns.extend(patterns)
+            
             local_dir = dir_config.get('local_path')
-            if local_path.startswith(local_dir):
-                relative_path = os.path.relpath(local_path, local_dir)
-                remote_dir = os.path.join(
-                    self.config['server']['mount_point'],
-                    dir_config.get('remote_path')
-                )
-                return os.path.join(remote_dir, relative_path)
-        return None
+            if not local_dir:
+                continue
+            remote_dir = os.path.join(mount_point, dir_config.get('remote_path', ''))
+            
+            node = trie
+            for part in self._split_path(local_dir):
+                node = node.setdefault(part, {})
+            node[None] = (os.path.normpath(local_dir), remote_dir, self._compile_exclude(patterns))
+        
+        return trie, self._compile_exclude(all_patterns)
+    
+    def _match_directory(self, directory):
+        """Find the deepest configured sync directory containing directory"""
+        node = self._trie
+        match = node.get(None)
+        # Walking whole components means /foo/barbaz never matches a /foo/bar root
+        for part in self._split_path(directory):
+            node = node.get(part)
+            if node is None:
+                break
+            match = node.get(None, match)
+        return match
+    
+    def _get_remote_path(self, local_path):
+        """Convert a local path to its corresponding remote path"""
+        match = self._directory_for(os.path.dirname(local_path))
+        if not match:
+            return None
+        local_root, remote_root, _ = match
+        return os.path.join(remote_root, os.path.relpath(local_path, local_root))
     
     def _should_sync_file(self, file_path):
-        """Check if a file should be synced based on include/exclude patterns"""
-        # This is a simplified implementation
+        """Check if a file should be synced based on exclude patterns"""
         filename = os.path.basename(file_path)
+        match = self._directory_for(os.path.dirname(file_path))
         
-        # Check against exclude patterns
-        for dir_config in self.config.get('sync_directories', []):
-            for pattern in dir_config.get('exclude_patterns', []):
-                if pattern.startswith('*'):
-                    if filename.endswith(pattern[1:]):
-                        return False
-                elif pattern.endswith('*'):
-                    if filename.startswith(pattern[:-1]):
-                        return False
-                elif pattern == filename:
-                    return False
-        
-        return True
-    
-    def sync_file(self, action, file_path, dest_path=None):
-        """Synchronize a single file based on the action"""
+        if match:
+            local_root, _, exclude_re = match
+            relative_path = os.path.relpath(file_path, local_root).replace(os.sep, '/')
+        else:
+            # Files outside every configured root are checked against all patterns by name
+            exclude_re = self._fallback_exclude_re
+            relative_path = filename
+        
+        if exclude_re is None:
+            return True
+        # Patterns may target either the path within the sync directory or the bare file name
+        return not (exclude_re.match(relative_path) or exclude_re.match(filename))
+    
+    def _ensure_dir(self, path):
+        """Create a remote directory unless it is already known to exist"""
+        if path in self._known_dirs:
+            return
+        os.makedirs(path, exist_ok=True)
+        
+        # makedirs created every parent too, so remember them up to the mount point
+        mount_point = os.path.normpath(self.config.get('server', {}).get('mount_point', os.sep))
+        with self._dirs_lock:
+            while path not in self._known_dirs:
+                self._known_dirs.add(path)
+                parent = os.path.dirname(path)
+                if parent == path or path == mount_point:
+                    break
+                path = parent
+    
+    def _forget_dirs(self):
+        """Drop the known-directory cache so the next pass re-checks everything"""
+        with self._dirs_lock:
+            self._known_dirs.clear()
+    
+    def _kernel_copy(self, copy_fn, src_fd, dst_fd, count):
+        """Copy up to count bytes with copy_fn(src_fd, dst_fd, n), returning bytes copied"""
+        copied = 0
+        try:
+            while copied < count:
+                n = copy_fn(src_fd, dst_fd, min(count - copied, KERNEL_COPY_CHUNK))
+                if n == 0:
+                    break
+                copied += n
+        except OSError as e:
+            if e.errno not in COPY_FALLBACK_ERRNOS:
+                raise
+        return copied
+    
+    def _fast_copy(self, src, dst):
+        """Copy src to dst without routing data through user space where possible
+        
+        Tries copy_file_range (server-side copy on NFS 4.2, reflinks on CoW
+        filesystems), then sendfile, then a plain buffered copy for whatever
+        remains. Metadata is preserved as shutil.copy2 does.
+        """
+        with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+            src_fd, dst_fd = fsrc.fileno(), fdst.fileno()
+            remaining = os.fstat(src_fd).st_size
+            
+            # Each step continues from the file offsets the previous one left behind
+            if remaining and hasattr(os, 'copy_file_range'):
+                remaining -= self._kernel_copy(os.copy_file_range, src_fd, dst_fd, remaining)
+            if remaining and hasattr(os, 'sendfile'):
+                remaining -= self._kernel_copy(
+                    lambda s, d, n: os.sendfile(d, s, None, n), src_fd, dst_fd, remaining
+                )
+            if remaining:
+                shutil.copyfileobj(fsrc, fdst)
+        
+        shutil.copystat(src, dst)
+    
+    def _fast_copy_and_hash(self, src, dst):
+        """Copy src to dst while hashing it, returning the content checksum
+        
+        Reads the source once, feeding each block to both the destination and
+        the hasher, so recording a checksum costs no extra read pass.
+        """
+        name, hasher = new_hasher()
+        buf = bytearray(HASH_COPY_BUFFER)
+        view = memoryview(buf)
+        with open(src, 'rb', buffering=0) as fsrc, open(dst, 'wb') as fdst:
+            while True:
+                n = fsrc.readinto(buf)
+                if not n:
+                    break
+                fdst.write(view[:n])
+                hasher.update(view[:n])
+        
+        shutil.copystat(src, dst)
+        return f"{name}:{hasher.hexdigest()}"
+    
+    def _copy_to_remote(self, file_path, remote_path, checksum=None):
+        """Copy a file to its remote path, returning its content checksum
+        
+        When the checksum is already known the copy can stay in the kernel;
+        otherwise it is computed from the same read that feeds the copy.
+        """
+        remote_dir = os.path.dirname(remote_path)
+        self._ensure_dir(remote_dir)
+        copy = self._fast_copy if checksum else self._fast_copy_and_hash
+        try:
+            result = copy(file_path, remote_path)
+        except FileNotFoundError:
+            # The remote directory may have been removed since it was cached
+            if not os.path.exists(file_path):
+                raise
+            self._forget_dirs()
+            self._ensure_dir(remote_dir)
+            result = copy(file_path, remote_path)
+        return checksum or result
+    
+    def sync_file(self, action, file_path, dest_path=None, update_metadata=True):
+        """Synchronize a single file based on the action, returning True on success"""
         if not self._should_sync_file(file_path):
             self.logger.debug(f"Skipping excluded file: {file_path}")
-            return
+            return False
         
-        remote_path = dest_path or self._get_remote_path(file_path)
+        # For moves dest_path is the local destination, not a remote path
+        if action == 'moved':
+            remote_path = self._get_remote_path(file_path)
+        else:
+            remote_path = dest_path or self._get_remote_path(file_path)
         if not remote_path:
             self.logger.warning(f"Could not determine remote path for: {file_path}")
-            return
+            return False
         
         try:
+            checksum = None
+            if action == 'modified' and update_metadata:
+                # Editors often rewrite files without changing them; skip the copy if the
+                # content matches what was last synced and the remote copy is still there
+                checksum = file_checksum(file_path)
+                metadata = self.metadata_db.get_file_metadata(file_path)
+                if metadata and metadata['checksum'] == checksum and os.path.exists(remote_path):
+                    self.metadata_db.update_file_metadata(file_path, checksum=checksum)
+                    self.logger.debug(f"Content unchanged, skipping copy: {file_path}")
+                    return True
+            
             if action == 'created' or action == 'modified':
-                # Ensure the directory exists
-                os.makedirs(os.path.dirname(remote_path), exist_ok=True)
-                # Copy the file
-                shutil.copy2(file_path, remote_path)
+                # Hash while copying even when a checksum was just computed: the file may
+                # have changed since, and the stored digest must match what was written
+                checksum = self._copy_to_remote(file_path, remote_path)
                 self.logger.info(f"Synced {action} file: {file_path} -> {remote_path}")
+                if update_metadata:
+                    self.metadata_db.update_file_metadata(file_path, checksum=checksum)
             
             elif action == 'deleted':
-                if os.path.exists(remote_path):
+                if os.path.isdir(remote_path) and not os.path.islink(remote_path):
+                    # A directory moved out of the watched tree
+                    shutil.rmtree(remote_path)
+                    self._forget_dirs()
+                    self.logger.info(f"Deleted remote directory: {remote_path}")
+                elif os.path.lexists(remote_path):
                     os.remove(remote_path)
                     self.logger.info(f"Deleted remote file: {remote_path}")
+                if update_metadata:
+                    self.metadata_db.delete_file_metadata(file_path)
             
             elif action == 'moved':
                 if dest_path:
                     remote_dest = self._get_remote_path(dest_path)
                     if remote_dest:
                         # Ensure the directory exists
-                        os.makedirs(os.path.dirname(remote_dest), exist_ok=True)
+                        self._ensure_dir(os.path.dirname(remote_dest))
                         # Move the file
                         shutil.move(remote_path, remote_dest)
+                        if os.path.isdir(remote_dest):
+                            # Cached directories below the old path no longer exist
+                            self._forget_dirs()
                         self.logger.info(f"Moved remote file: {remote_path} -> {remote_dest}")
+                        if update_metadata:
+                            moved = self.metadata_db.move_file_metadata(file_path, dest_path)
+                            if not moved and os.path.isfile(dest_path):
+                                self.metadata_db.update_file_metadata(dest_path)
+            
+            return True
         
         except Exception as e:
             self.logger.error(f"Error syncing file {file_path}: {e}")
+            return False
+    
+    def sync_batch(self, events):
+        """Synchronize a batch of (action, path, dest_path) events, one operation per path"""
+        latest = {}
+        for action, file_path, dest_path in events:
+            coalesce_event(latest, action, file_path, dest_path)
+        
+        if len(latest) < len(events):
+            self.logger.debug(f"Collapsed {len(events)} events into {len(latest)} sync operations")
+        
+        for file_path, (action, dest_path) in latest.items():
+            self.sync_file(action, file_path, dest_path)
+    
+    def _iter_files(self, local_dir):
+        """Yield (DirEntry, relative_path) for everything below local_dir
+        
+        Uses os.scandir so entry type and stat information come from the
+        directory listing instead of extra syscalls. Entries are not cached
+        between calls, so every sync pass sees fresh state.
+        """
+        stack = [(local_dir, '')]
+        while stack:
+            dir_path, relative_dir = stack.pop()
+            try:
+                with os.scandir(dir_path) as it:
+                    for entry in it:
+                        relative_path = os.path.join(relative_dir, entry.name) if relative_dir else entry.name
+                        # Like os.walk, report symlinked directories but do not descend into them
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append((entry.path, relative_path))
+                        yield entry, relative_path
+            except OSError as e:
+                self.logger.warning(f"Could not scan directory {dir_path}: {e}")
     
     def sync_directory(self, local_dir, remote_dir):
         """Synchronize an entire directory"""
         self.logger.info(f"Starting directory sync: {local_dir} -> {remote_dir}")
         
         # Ensure remote directory exists
-        os.makedirs(remote_dir, exist_ok=True)
+        self._ensure_dir(remote_dir)
+        
+        candidates = {}  # local path -> path relative to local_dir
+        stats = {}
         
         # Walk through the local directory
-        for root, dirs, files in os.walk(local_dir):
+        for entry, relative_path in self._iter_files(local_dir):
             # Create corresponding remote directories
-            for dir_name in dirs:
-                local_path = os.path.join(root, dir_name)
-                relative_path = os.path.relpath(local_path, local_dir)
-                remote_path = os.path.join(remote_dir, relative_path)
-                os.makedirs(remote_path, exist_ok=True)
+            if entry.is_dir():
+                self._ensure_dir(os.path.join(remote_dir, relative_path))
+                continue
             
             # Sync files
-            for file_name in files:
-                local_path = os.path.join(root, file_name)
-                if self._should_sync_file(local_path):
-                    relative_path = os.path.relpath(local_path, local_dir)
-                    remote_path = os.path.join(remote_dir, relative_path)
-                    self.sync_file('created', local_path, remote_path)
+            if self._should_sync_file(entry.path):
+                try:
+                    stats[entry.path] = entry.stat()
+                except OSError as e:
+                    self.logger.warning(f"Could not stat {entry.path}: {e}")
+                    continue
+                candidates[entry.path] = relative_path
+        
+        # Compare against stored metadata in one pass and copy only what changed
+        changed = self.metadata_db.needs_sync_many(candidates, stats)
+        self.logger.info(f"{len(changed)} of {len(candidates)} files need syncing in {local_dir}")
+        
+        # Remote directories were all created during the scan, so workers never race on them
+        futures = {}
+        for local_path, relative_path in candidates.items():
+            if local_path not in changed:
+                continue
+            remote_path = os.path.join(remote_dir, relative_path)
+            future = self._pool.submit(self._copy_to_remote, local_path, remote_path)
+            futures[future] = (local_path, remote_path)
+        
+        synced = []
+        checksums = {}
+        for future in as_completed(futures):
+            local_path, remote_path = futures[future]
+            try:
+                checksums[local_path] = future.result()
+                synced.append(local_path)
+                self.logger.info(f"Synced created file: {local_path} -> {remote_path}")
+            except Exception as e:
+                self.logger.error(f"Error syncing file {local_path}: {e}")
+        
+        if len(synced) < len(futures):
+            self.logger.warning(f"{len(futures) - len(synced)} of {len(futures)} files failed to sync in {local_dir}")
+        
+        # Record everything copied in this pass with one batched write
+        self.metadata_db.update_many(synced, stats, checksums)
     
     def full_sync(self):
         """Perform a full synchronization of all configured directories"""
         self.logger.info("Starting full synchronization")
+        self._forget_dirs()
         
         for dir_config in self.config.get('sync_directories', []):
             local_path = dir_config.get('local_path')
@@ -12,7 +12,7 @@ apt-get update
 apt-get install -y python3 python3-pip sqlite3
 
 # Install Python packages
-pip3 install flask gunicorn
+pip3 install flask gunicorn orjson
 
 # Create service user
 useradd -r -s /bin/false modsync || true
@@ -4,10 +4,15 @@ Log Server for KSP Mod Sync
 Provides a REST API for logging and generates text log files from the database.
 """
 
-from flask import Flask, request, jsonify
+from flask import Flask, request, Response
+import orjson
 import sqlite3
 import os
 import time
+import queue
+import atexit
+import collections
+from contextlib import contextmanager
 from datetime import datetime
 import threading
 
@@ -18,13 +23,65 @@ DATABASE_FILE = "modsync_logs.db"
 LOG_OUTPUT_DIR = "logs"
 LOG_FILE = os.path.join(LOG_OUTPUT_DIR, "modsync.log")
 LOG_ROTATION_INTERVAL = 86400  # 24 hours in seconds
+PROCESS_BATCH_SIZE = 1000  # Maximum rows written to the text log per pass
+PROCESS_HEARTBEAT = 30  # Seconds between checks when no new logs are signalled
+LOG_BUFFER_SIZE = 1 << 16  # Write buffer for the text log file
+PENDING_LIMIT = 100000  # Accepted logs waiting to be inserted before new ones are refused
+WRITE_BATCH_SIZE = 1000  # Maximum rows per insert transaction
+WRITE_WINDOW = 0.01  # Seconds to let accepted logs accumulate before inserting them
+MAINTENANCE_INTERVAL = 900  # 15 minutes in seconds
+LOG_RETENTION = '-7 days'  # Processed rows older than this are deleted from the database
+
+# Applied to every connection so readers and the writer never block each other
+CONNECTION_PRAGMAS = (
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA busy_timeout=5000',
+)
+
+# Reclaim free pages, shrink the WAL and refresh query planner statistics
+MAINTENANCE_PRAGMAS = (
+    'PRAGMA incremental_vacuum(128000)',
+    'PRAGMA wal_checkpoint(TRUNCATE)',
+    'PRAGMA optimize',
+)
 
 # Ensure log directory exists
 os.makedirs(LOG_OUTPUT_DIR, exist_ok=True)
 
+# Text log handle kept open between batches; swapped out by rotate_logs under the lock
+log_writer_lock = threading.RLock()
+log_fh = open(LOG_FILE, 'a', buffering=LOG_BUFFER_SIZE)
+
+def log_file_rotated():
+    """Whether LOG_FILE is no longer the file behind log_fh; caller holds log_writer_lock"""
+    try:
+        return os.stat(LOG_FILE).st_ino != os.fstat(log_fh.fileno()).st_ino
+    except FileNotFoundError:
+        return True
+
+def reopen_log_file():
+    """Point log_fh at the current LOG_FILE; caller holds log_writer_lock"""
+    global log_fh
+    log_fh.close()
+    log_fh = open(LOG_FILE, 'a', buffering=LOG_BUFFER_SIZE)
+
+def open_connection():
+    """Open a database connection that can be shared between threads"""
+    conn = sqlite3.connect(DATABASE_FILE, check_same_thread=False)
+    for pragma in CONNECTION_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
 # Initialize database
 def init_db():
+    is_new = not os.path.exists(DATABASE_FILE) or os.path.getsize(DATABASE_FILE) == 0
     conn = sqlite3.connect(DATABASE_FILE)
+    if is_new:
+        # Only takes effect before any table exists or WAL mode is enabled
+        conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+    for pragma in CONNECTION_PRAGMAS:
+        conn.execute(pragma)
     cursor = conn.cursor()
     cursor.execute('''
     CREATE TABLE IF NOT EXISTS logs (
@@ -44,27 +101,72 @@ def init_db():
 
 init_db()
 
+# A single writer connection serialized by a lock, plus a pool of readers
+WRITER_CONN = open_connection()
+writer_lock = threading.Lock()
+
+read_pool = queue.Queue()
+for _ in range(os.cpu_count() or 1):
+    read_pool.put(open_connection())
+
+# Set whenever new rows are inserted so the processor wakes immediately
+log_ready = threading.Event()
+
+# Accepted log rows waiting for the writer thread, and its wakeup signal
+pending = collections.deque()
+pending_evt = threading.Event()
+
+# Fields copied into the logs table; each must be a value SQLite can store
+LOG_FIELDS = ('timestamp', 'computer', 'process_id', 'session_id', 'platform', 'level', 'message')
+SCALAR_TYPES = (str, int, float, bool, type(None))
+SQLITE_INT_MIN, SQLITE_INT_MAX = -(1 << 63), (1 << 63) - 1
+
+INSERT_LOG_SQL = '''
+INSERT INTO logs (timestamp, computer, process_id, session_id, platform, level, message)
+VALUES (?, ?, ?, ?, ?, ?, ?)
+'''
+
+@contextmanager
+def read_connection():
+    """Borrow a connection from the read pool"""
+    conn = read_pool.get()
+    try:
+        yield conn
+    finally:
+        read_pool.put(conn)
+
+def json_response(payload, status):
+    """Serialize payload with orjson into a Flask response"""
+    return Response(orjson.dumps(payload), status=status, mimetype='application/json')
+
 # API endpoint to receive logs
 @app.route('/api/logs', methods=['POST'])
 def add_log():
     try:
-        data = request.json
+        try:
+            data = orjson.loads(request.get_data())
+        except orjson.JSONDecodeError as e:
+            return json_response({"error": f"Invalid JSON: {e}"}, 400)
+        if not isinstance(data, dict):
+            return json_response({"error": "Expected a JSON object"}, 400)
         
         # Validate required fields
         required_fields = ['timestamp', 'computer', 'platform', 'message']
         for field in required_fields:
             if field not in data:
-                return jsonify({"error": f"Missing required field: {field}"}), 400
+                return json_response({"error": f"Missing required field: {field}"}, 400)
+        for field in LOG_FIELDS:
+            value = data.get(field)
+            if not isinstance(value, SCALAR_TYPES):
+                return json_response({"error": f"Field must be a string or number: {field}"}, 400)
+            if isinstance(value, int) and not SQLITE_INT_MIN <= value <= SQLITE_INT_MAX:
+                return json_response({"error": f"Integer out of range: {field}"}, 400)
         
-        # Connect to database
-        conn = sqlite3.connect(DATABASE_FILE)
-        cursor = conn.cursor()
+        if len(pending) >= PENDING_LIMIT:
+            return json_response({"error": "Log queue is full, retry later"}, 503)
         
-        # Insert log entry
-        cursor.execute('''
-        INSERT INTO logs (timestamp, computer, process_id, session_id, platform, level, message)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (
+        # Queue the entry for the writer thread
+        pending.append((
             data.get('timestamp'),
             data.get('computer'),
             data.get('process_id', 0),
@@ -73,48 +175,104 @@ def add_log():
             data.get('level', 'INFO'),
             data.get('message')
         ))
+        pending_evt.set()
         
-        conn.commit()
-        conn.close()
-        
-        return jsonify({"status": "success"}), 201
+        return json_response({"status": "accepted"}, 202)
     
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        return json_response({"error": str(e)}, 500)
+
+# Insert everything currently queued, in batches of one transaction each
+def flush_pending():
+    while pending:
+        rows = [pending.popleft() for _ in range(min(len(pending), WRITE_BATCH_SIZE))]
+        with writer_lock:
+            try:
+                WRITER_CONN.executemany(INSERT_LOG_SQL, rows)
+                WRITER_CONN.commit()
+            except sqlite3.OperationalError:
+                # Locked or failing database: keep the batch for the next attempt
+                WRITER_CONN.rollback()
+                pending.extendleft(reversed(rows))
+                raise
+            except Exception as e:
+                # A bad row fails the whole batch (sqlite3.Error, or e.g. OverflowError
+                # while binding), so insert one by one to keep the rest
+                WRITER_CONN.rollback()
+                print(f"Batch insert failed, retrying row by row: {e}")
+                insert_rows(rows)
+        log_ready.set()
+
+def insert_rows(rows):
+    """Insert rows individually, dropping any the database rejects; caller holds writer_lock"""
+    for row in rows:
+        try:
+            WRITER_CONN.execute(INSERT_LOG_SQL, row)
+        except sqlite3.OperationalError:
+            WRITER_CONN.rollback()
+            pending.extendleft(reversed(rows))
+            raise
+        except Exception as e:
+            print(f"Dropping log row that could not be inserted: {e}")
+    WRITER_CONN.commit()
+
+# Function to move accepted logs into the database
+def write_logs():
+    while True:
+        try:
+            pending_evt.wait()
+            # Let concurrent requests pile up so they share one commit
+            time.sleep(WRITE_WINDOW)
+            pending_evt.clear()
+            flush_pending()
+        
+        except Exception as e:
+            print(f"Error writing logs: {e}")
+            # Whatever is still queued gets retried on the next pass
+            pending_evt.set()
+            time.sleep(1)
 
 # Function to process logs and write to text file
 def process_logs():
     while True:
         try:
-            conn = sqlite3.connect(DATABASE_FILE)
-            cursor = conn.cursor()
+            # Clear before reading so inserts that land after the query still wake us
+            log_ready.clear()
             
-            # Get unprocessed logs
-            cursor.execute('''
-            SELECT id, timestamp, computer, process_id, session_id, platform, level, message
-            FROM logs
-            WHERE processed = 0
-            ORDER BY timestamp
-            ''')
-            
-            logs = cursor.fetchall()
+            # Get unprocessed logs; WAL lets this read run alongside inserts
+            with read_connection() as conn:
+                logs = conn.execute('''
+                SELECT id, timestamp, computer, process_id, session_id, platform, level, message
+                FROM logs
+                WHERE processed = 0
+                ORDER BY timestamp
+                LIMIT ?
+                ''', (PROCESS_BATCH_SIZE,)).fetchall()
             
             if logs:
-                with open(LOG_FILE, 'a') as f:
-                    for log in logs:
-                        log_id, timestamp, computer, process_id, session_id, platform, level, message = log
-                        log_entry = f"[{timestamp}] [{computer}:{process_id}:{session_id}] [{platform}] [{level}] {message}\n"
-                        f.write(log_entry)
-                        
-                        # Mark as processed
-                        cursor.execute('UPDATE logs SET processed = 1 WHERE id = ?', (log_id,))
+                entries = []
+                for log in logs:
+                    log_id, timestamp, computer, process_id, session_id, platform, level, message = log
+                    entries.append(f"[{timestamp}] [{computer}:{process_id}:{session_id}] [{platform}] [{level}] {message}\n")
                 
-                conn.commit()
-            
-            conn.close()
+                # One write and flush per batch
+                with log_writer_lock:
+                    # Another worker process may have rotated the file under us
+                    if log_file_rotated():
+                        reopen_log_file()
+                    log_fh.write(''.join(entries))
+                    log_fh.flush()
+                
+                # Mark the whole batch as processed in one transaction
+                with writer_lock:
+                    WRITER_CONN.executemany('UPDATE logs SET processed = 1 WHERE id = ?',
+                                            [(log[0],) for log in logs])
+                    WRITER_CONN.commit()
             
-            # Sleep for a short time before checking again
-            time.sleep(5)
+            # A full batch means more rows are probably waiting; otherwise wait for new
+            # logs, with a heartbeat in case another process inserted them
+            if len(logs) < PROCESS_BATCH_SIZE:
+                log_ready.wait(timeout=PROCESS_HEARTBEAT)
             
         except Exception as e:
             print(f"Error processing logs: {e}")
@@ -122,21 +280,36 @@ def process_logs():
 
 # Function to rotate log files
 def rotate_logs():
+    global log_fh
     while True:
         try:
-            if os.path.exists(LOG_FILE):
-                # Create a timestamp for the rotated file
-                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                rotated_file = f"{LOG_FILE}.{timestamp}"
-                
-                # Rename current log file
-                os.rename(LOG_FILE, rotated_file)
-                
-                # Create a new empty log file
-                with open(LOG_FILE, 'w') as f:
-                    f.write(f"Log started at {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
-                
-                print(f"Rotated log file to {rotated_file}")
+            with log_writer_lock:
+                if log_file_rotated():
+                    # Another worker process already rotated it; just follow the new file
+                    reopen_log_file()
+                # The handle creates the file at startup, so skip rotating it while still empty
+                elif os.path.getsize(LOG_FILE) > 0:
+                    # Timestamp plus pid keeps names unique across worker processes
+                    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+                    rotated_file = f"{LOG_FILE}.{timestamp}.{os.getpid()}"
+                    
+                    # Close our handle first so nothing is written to the rotated file
+                    # afterwards and the rename also works on Windows
+                    log_fh.flush()
+                    log_fh.close()
+                    try:
+                        os.replace(LOG_FILE, rotated_file)
+                    finally:
+                        log_fh = open(LOG_FILE, 'a', buffering=LOG_BUFFER_SIZE)
+                    
+                    log_fh.write(f"Log started at {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
+                    log_fh.flush()
+                    
+                    print(f"Rotated log file to {rotated_file}")
+            
+            # Keep the WAL file from growing without bound between rotations
+            with writer_lock:
+                WRITER_CONN.execute('PRAGMA wal_checkpoint(TRUNCATE)')
             
             # Sleep for the rotation interval
             time.sleep(LOG_ROTATION_INTERVAL)
@@ -145,12 +318,38 @@ def rotate_logs():
             print(f"Error rotating logs: {e}")
             time.sleep(3600)  # Retry in an hour
 
+# Function to prune old logs and reclaim database space
+def maintain_db():
+    while True:
+        time.sleep(MAINTENANCE_INTERVAL)
+        try:
+            with writer_lock:
+                WRITER_CONN.execute('''
+                DELETE FROM logs
+                WHERE processed = 1 AND timestamp < date('now', ?)
+                ''', (LOG_RETENTION,))
+                WRITER_CONN.commit()
+                
+                # executescript steps each pragma to completion; a plain execute would
+                # make incremental_vacuum free only a single page
+                WRITER_CONN.executescript(';'.join(MAINTENANCE_PRAGMAS))
+        
+        except Exception as e:
+            print(f"Error maintaining database: {e}")
+
 # Start background threads
+log_writer = threading.Thread(target=write_logs, daemon=True)
+log_writer.start()
+atexit.register(flush_pending)
+
 log_processor = threading.Thread(target=process_logs, daemon=True)
 log_processor.start()
 
 log_rotator = threading.Thread(target=rotate_logs, daemon=True)
 log_rotator.start()
 
+db_maintainer = threading.Thread(target=maintain_db, daemon=True)
+db_maintainer.start()
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000) 
\ No newline at end of file
@@ -0,0 +1,134 @@
+"""
+test_file_monitor.py - Tests for event coalescing in the file monitor
+"""
+import os
+import sys
+import json
+
+import pytest
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+pytest.importorskip('watchdog')
+
+from queue import Queue
+from core.file_monitor import FileChangeHandler
+from core.sync_engine import SyncEngine, coalesce_event
+
+def coalesce(*events):
+    pending = {}
+    for event in events:
+        coalesce_event(pending, *event)
+    return list(pending.items())
+
+def test_temp_file_renamed_over_target_is_created():
+    # Editors save atomically: write a temp file, then rename it over the original
+    local = os.path.join('watched', 'notes.txt')
+    temp = local + '.swp'
+    
+    sync_queue = Queue()
+    handler = FileChangeHandler(sync_queue, {})
+    handler._record('created', temp)
+    handler._record('modified', temp)
+    handler._record('moved', temp, local)
+    handler.flush()
+    
+    assert sync_queue.get_nowait() == [('created', local, None)]
+
+def test_latest_change_orders_batch():
+    pending = {}
+    coalesce_event(pending, 'modified', 'a')
+    coalesce_event(pending, 'modified', 'b')
+    coalesce_event(pending, 'deleted', 'a')
+    
+    assert list(pending.items()) == [('b', ('modified', None)), ('a', ('deleted', None))]
+
+def test_chained_move_keeps_original_source():
+    pending = {}
+    coalesce_event(pending, 'moved', 'a', 'b')
+    coalesce_event(pending, 'moved', 'b', 'c')
+    
+    assert pending == {'a': ('moved', 'c')}
+
+def test_path_reused_after_move_keeps_move():
+    # Log rotation: mv x.log x.log.1; touch x.log
+    assert coalesce(('moved', 'x.log', 'x.log.1'), ('created', 'x.log')) == [
+        ('x.log.1', ('created', None)),
+        ('x.log', ('modified', None)),
+    ]
+
+def test_backup_then_replace_keeps_backup():
+    assert coalesce(('created', 'f.tmp'), ('moved', 'f', 'f~'), ('moved', 'f.tmp', 'f')) == [
+        ('f~', ('created', None)),
+        ('f', ('created', None)),
+    ]
+
+def test_swap_copies_both_files():
+    assert coalesce(('moved', 'a', 't'), ('moved', 'b', 'a'), ('moved', 't', 'b')) == [
+        ('a', ('created', None)),
+        ('b', ('created', None)),
+    ]
+
+@pytest.fixture
+def sync_dirs(tmp_path):
+    local = tmp_path / 'local'
+    remote = tmp_path / 'remote'
+    local.mkdir()
+    remote.mkdir()
+    
+    config_path = tmp_path / 'sync_config.json'
+    config_path.write_text(json.dumps({
+        'sync_directories': [{'local_path': str(local), 'remote_path': str(remote)}],
+        'sync_settings': {'metadata_db': str(tmp_path / 'metadata.db')},
+    }))
+    return SyncEngine(str(config_path)), local, remote
+
+def test_temp_file_rename_syncs(sync_dirs):
+    engine, local, remote = sync_dirs
+    
+    temp = local / 'notes.txt.tmp'
+    temp.write_text('saved')
+    temp.rename(local / 'notes.txt')
+    
+    pending = {}
+    coalesce_event(pending, 'created', str(temp))
+    coalesce_event(pending, 'moved', str(temp), str(local / 'notes.txt'))
+    engine.sync_batch([(action, path, dest) for path, (action, dest) in pending.items()])
+    
+    assert (remote / 'notes.txt').read_text() == 'saved'
+    assert not (remote / 'notes.txt.tmp').exists()
+
+def test_sync_batch_keeps_move_when_path_reused(sync_dirs):
+    engine, local, remote = sync_dirs
+    (local / 'x.log').write_text('old')
+    engine.sync_file('created', str(local / 'x.log'))
+    
+    (local / 'x.log').rename(local / 'x.log.1')
+    (local / 'x.log').write_text('new')
+    engine.sync_batch([
+        ('moved', str(local / 'x.log'), str(local / 'x.log.1')),
+        ('created', str(local / 'x.log'), None),
+    ])
+    
+    assert (remote / 'x.log.1').read_text() == 'old'
+    assert (remote / 'x.log').read_text() == 'new'
+
+def test_sync_batch_swap(sync_dirs):
+    engine, local, remote = sync_dirs
+    for name in ('a', 'b'):
+        (local / name).write_text(name)
+        engine.sync_file('created', str(local / name))
+    
+    (local / 'a').rename(local / 't')
+    (local / 'b').rename(local / 'a')
+    (local / 't').rename(local / 'b')
+    engine.sync_batch([
+        ('moved', str(local / 'a'), str(local / 't')),
+        ('moved', str(local / 'b'), str(local / 'a')),
+        ('moved', str(local / 't'), str(local / 'b')),
+    ])
+    
+    assert (remote / 'a').read_text() == 'b'
+    assert (remote / 'b').read_text() == 'a'
+    assert not (remote / 't').exists()
@@ -0,0 +1,52 @@
+"""
+test_log_server.py - Tests for the log server's insert path
+"""
+import os
+import sys
+import importlib
+
+import pytest
+
+# Add the server directory to path for imports
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'server')))
+
+pytest.importorskip('flask')
+pytest.importorskip('orjson')
+
+@pytest.fixture(scope='module')
+def log_server(tmp_path_factory):
+    # The module creates its database and log files relative to the working directory
+    cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp('log_server'))
+    try:
+        yield importlib.import_module('log_server')
+    finally:
+        os.chdir(cwd)
+
+def count_messages(log_server, *messages):
+    with log_server.writer_lock:
+        placeholders = ','.join('?' * len(messages))
+        return log_server.WRITER_CONN.execute(
+            f"SELECT COUNT(*) FROM logs WHERE message IN ({placeholders})", messages
+        ).fetchone()[0]
+
+def test_bad_row_does_not_drop_batch(log_server):
+    log_server.pending.extend([
+        ('t', 'c', 0, '', 'p', 'INFO', 'before'),
+        ('t', 'c', 1 << 64, '', 'p', 'INFO', 'overflow'),
+        ('t', 'c', 0, '', 'p', 'INFO', 'after'),
+    ])
+    log_server.flush_pending()
+    
+    assert not log_server.pending
+    assert not log_server.WRITER_CONN.in_transaction
+    assert count_messages(log_server, 'before', 'after') == 2
+    assert count_messages(log_server, 'overflow') == 0
+
+def test_out_of_range_integer_is_rejected(log_server):
+    client = log_server.app.test_client()
+    response = client.post('/api/logs', data=b'{"timestamp": "t", "computer": "c", "platform": "p", '
+                                              b'"message": "m", "process_id": 18446744073709551615}')
+    
+    assert response.status_code == 400
+    assert not log_server.pending